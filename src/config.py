@@ -3,12 +3,19 @@ import os
 
 load_dotenv()
 
+REDASH_DOMAIN = os.getenv("REDASH_DOMAIN")
+DATA_PATH = os.getenv("DATA_PATH")
+DATA_FORMAT = os.getenv("DATA_FORMAT", "csv").lower()
+if DATA_FORMAT not in ("csv", "parquet"):
+    raise ValueError(f"Unsupported DATA_FORMAT '{DATA_FORMAT}', expected 'csv' or 'parquet'")
+
 CONFIG = {
-    "redash_domain": os.getenv("REDASH_DOMAIN"),
+    "redash_domain": REDASH_DOMAIN,
     "webhook_err": os.getenv("WEBHOOK_URL"),
     "service_account_path": os.getenv("SERVICE_ACCOUNT_PATH"),
     "sheet_id": os.getenv("SHEET_ID"),
-    "data_path": os.getenv("DATA_PATH"),
+    "data_path": DATA_PATH,
+    "data_format": DATA_FORMAT,
     "log_path": os.getenv("LOG_PATH"),
     "pbi_title": os.getenv("PBI_TITLE"),
     "scopes": [
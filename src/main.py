@@ -1,22 +1,23 @@
 import sys
+import os
+import csv
 import asyncio
-import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
 import logging
 import time
-import json
+import re
+import random
+import orjson
+import functools
+from concurrent.futures import ThreadPoolExecutor
 import aiohttp
-from tenacity import retry, stop_after_attempt, wait_fixed
+from tenacity import retry, stop_after_attempt, wait_fixed, RetryError
 from tabulate import tabulate
 import gspread
 from google.oauth2 import service_account
-import schedule
-import ctypes
-import pyautogui
-import pyperclip
-from pywinauto import Application, Desktop
 from .utils import setup_logging, capture_area, upload_image, convert_numpy
-from .config import CONFIG
+from .config import CONFIG, REDASH_DOMAIN, DATA_PATH, DATA_FORMAT
 
 # Redash Exception
 class RedashDataException(Exception):
@@ -25,25 +26,57 @@ class RedashDataException(Exception):
         self.row = row
         self.original_exception = original_exception
 
+# Webhook Session
+_WEBHOOK = requests.Session()
+_WEBHOOK.mount('https://', HTTPAdapter(pool_connections=8, pool_maxsize=16))
+_WEBHOOK.mount('http://', HTTPAdapter(pool_connections=8, pool_maxsize=16))
+
+# Google Sheets Functions
+@functools.lru_cache(maxsize=1)
+def _gspread_client():
+    """Authorize a gspread client once per process."""
+    creds = service_account.Credentials.from_service_account_file(CONFIG['service_account_path'], scopes=CONFIG['scopes'])
+    return gspread.authorize(creds)
+
+@functools.lru_cache(maxsize=1)
+def _spreadsheet():
+    """Open the task configuration spreadsheet once per process."""
+    return _gspread_client().open_by_key(CONFIG['sheet_id'])
+
 # Redash Functions
+def _orjson_dumps(obj):
+    """Serialize request payloads with orjson."""
+    return orjson.dumps(obj).decode()
+
+def _save_query_result(save_name, columns, rows):
+    """Save Redash result rows to DATA_PATH as CSV or Parquet."""
+    save_path = os.path.join(DATA_PATH, save_name)
+    if DATA_FORMAT == 'parquet':
+        import pandas as pd
+        pd.DataFrame(rows, columns=columns).to_parquet(f"{save_path}.parquet", compression='snappy', index=False)
+    else:
+        with open(f"{save_path}.csv", 'w', newline='', encoding='utf-8', buffering=1 << 20) as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+
 @retry(stop=stop_after_attempt(5), wait=wait_fixed(1))
 async def get_redash_data(row, session, failed_info_dict, start_run):
-    """Fetch data from a Redash query and save to CSV."""
+    """Fetch data from a Redash query and save to CSV or Parquet."""
     row['execute_status'] = 'failed'
     row['query_result_id'] = 0
-    row['query_result'] = pd.DataFrame()
     row['rows_cnt'] = 0
     row['runtime'] = 0
     row['execute_time'] = 0
 
     redash_headers = {'Authorization': f"Key {row['api_key']}"}
-    params = json.loads(row['params'].replace("'", "\"")) if row['params'] else {}
+    params = orjson.loads(row['params'].replace("'", "\"")) if row['params'] else {}
     start_execute = time.time()
     executing = False
     in_queue = False
 
     try:
-        url_result = f"{CONFIG['redash_domain']}/api/queries/{row['query_id']}/results"
+        url_result = f"{REDASH_DOMAIN}/api/queries/{row['query_id']}/results"
         payload_result = {
             'apply_auto_limit': False,
             'id': row['query_id'],
@@ -51,7 +84,7 @@ async def get_redash_data(row, session, failed_info_dict, start_run):
             'parameters': params
         }
         async with session.post(url_result, json=payload_result, headers=redash_headers) as response:
-            response_result_json = await response.json()
+            response_result_json = await response.json(loads=orjson.loads)
             if response.status != 200:
                 if 'job' in response_result_json:
                     raise Exception(response_result_json['job'].get('error', response_result_json))
@@ -62,10 +95,12 @@ async def get_redash_data(row, session, failed_info_dict, start_run):
         if job_id is None:
             raise Exception(response_result_json['job']['error'])
         
-        url_job = f"{CONFIG['redash_domain']}/api/jobs/{job_id}"
+        url_job = f"{REDASH_DOMAIN}/api/jobs/{job_id}"
+        url_query_results = f"{REDASH_DOMAIN}/api/query_results/"
+        delay = 0.5
         while True:
             async with session.get(url_job, headers=redash_headers) as request_job:
-                job_result = await request_job.json()
+                job_result = await request_job.json(loads=orjson.loads)
                 job_status = job_result['job']['status']
                 
                 if job_status == 1:
@@ -77,40 +112,56 @@ async def get_redash_data(row, session, failed_info_dict, start_run):
                     if not executing:
                         logging.info(f"Executing query...: {row['query_id']} - {row['query_name']}")
                         start_execute = time.time()
+                        delay = 0.5
                     in_queue = False
                     executing = True
 
                 elif job_status == 3:
                     logging.info(f"Completed query {row['query_id']} - {row['query_name']}")
                     query_result_id = job_result['job']['query_result_id']
-                    url_query_result_id = f"{CONFIG['redash_domain']}/api/query_results/{query_result_id}"
+                    url_query_result_id = f"{url_query_results}{query_result_id}"
                     async with session.get(url_query_result_id, headers=redash_headers) as request_query_result:
-                        response_query_result = await request_query_result.json()
+                        response_query_result = await request_query_result.json(loads=orjson.loads)
                         execute_time = "{:.2f}".format(response_query_result['query_result']['runtime'])
-                        if response_query_result['query_result']['data']['rows']:
-                            query_result = pd.DataFrame(response_query_result['query_result']['data']['rows'])
-                        else:
-                            columns = [col['name'] for col in response_query_result['query_result']['data']['columns']]
-                            rows = [[
-                                time.strftime('%Y-%m-%d %H:%M') if col['name'] == 'datetime_run'
-                                else params['wh_id'] if col['name'] == 'wh_hub_id' and 'wh_id' in params
-                                else '' for col in response_query_result['query_result']['data']['columns']]]
-                            query_result = pd.DataFrame(rows, columns=columns)
-                        query_result.to_csv(os.path.join(CONFIG['data_path'], f"{row['query_save_name']}.csv"), index=False)
-
-                    row['execute_status'] = 'success'
+                        columns = [col['name'] for col in response_query_result['query_result']['data']['columns']]
+                        rows = response_query_result['query_result']['data']['rows']
+                        if not rows:
+                            datetime_run = time.strftime('%Y-%m-%d %H:%M')
+                            wh_id = params.get('wh_id', '')
+                            rows = [{
+                                name: datetime_run if name == 'datetime_run'
+                                else wh_id if name == 'wh_hub_id'
+                                else '' for name in columns}]
+
                     row['query_result_id'] = query_result_id
-                    row['query_result'] = query_result
-                    row['rows_cnt'] = len(query_result)
-                    row['runtime'] = "{:.2f}".format(time.time() - start_run)
                     row['execute_time'] = execute_time
+                    # Save failures are recorded here so tenacity does not re-run a query that already succeeded
+                    try:
+                        _save_query_result(row['query_save_name'], columns, rows)
+                    except Exception as error:
+                        ref_name = (row['query_id'], row['query_name'])
+                        failed_info_dict[ref_name].append({
+                            'query_id': row['query_id'],
+                            'query_name': row['query_name'],
+                            'attempt': len(failed_info_dict[ref_name]) + 1,
+                            'error': f"Save result failed: {error}"
+                        })
+                        logging.error(f"Save result failed: Query {row['query_id']} - {row['query_name']}: {error}")
+                        row['execute_status'] = 'save_failed'
+                    else:
+                        row['execute_status'] = 'success'
+                        row['rows_cnt'] = len(rows)
+                    row['runtime'] = "{:.2f}".format(time.time() - start_run)
                     return row
 
                 elif job_status == 4 or job_status == 5:
                     raise Exception(job_result['job']['error'])
 
+            await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+            delay = min(delay * 1.5, 5.0)
+
     except Exception as error:
-        ref_name = f"{row['query_id']}{row['query_name']}"
+        ref_name = (row['query_id'], row['query_name'])
         failed_info_dict[ref_name].append({
             'query_id': row['query_id'], 
             'query_name': row['query_name'], 
@@ -122,20 +173,48 @@ async def get_redash_data(row, session, failed_info_dict, start_run):
         row['runtime'] = "{:.2f}".format(time.time() - start_run)
         raise RedashDataException(row, error)
 
+def _is_number(value):
+    """Check whether a table cell holds a number so its column can be right-aligned."""
+    try:
+        float(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+def _format_table(records, fields):
+    """Render records as a fixed-width text table, one line per record."""
+    cells = [[" ".join(str(record.get(field, '')).splitlines()) for field in fields] for record in records]
+    numeric = [all(_is_number(row[i]) for row in cells if row[i] != '') for i in range(len(fields))]
+    widths = [max([len(field)] + [len(row[i]) for row in cells]) for i, field in enumerate(fields)]
+
+    def render(values):
+        return "  ".join(value.rjust(width) if right else value.ljust(width) for value, width, right in zip(values, widths, numeric)).rstrip()
+
+    lines = [render(fields), "  ".join("-" * width for width in widths)]
+    lines.extend(render(row) for row in cells)
+    return "\n".join(lines)
+
 async def execute_redash(task_list):
     """Execute Redash queries for the given task list."""
-    creds = service_account.Credentials.from_service_account_file(CONFIG['service_account_path'], scopes=CONFIG['scopes'])
-    client = gspread.authorize(creds)
-    
-    sheet = pd.DataFrame(client.open_by_key(CONFIG['sheet_id']).worksheet("taskQueries").get_all_records())
-    task_queries = sheet[(sheet['active_flag'].str.lower() == 'y') & (sheet['run_flag'].str.lower() == 'y') & (sheet['task_name'].isin(task_list))].reset_index(drop=True)
-    task_queries = task_queries.drop_duplicates(subset=['query_id', 'params', 'query_save_name'], keep='first')
-    logging.info(f'Task queries:\n{task_queries}')
+    task_set = frozenset(task_list)
+    records = _spreadsheet().worksheet("taskQueries").get_all_records()
+    seen = set()
+    task_queries = []
+    for record in records:
+        if str(record['active_flag']).lower() != 'y' or str(record['run_flag']).lower() != 'y' or record['task_name'] not in task_set:
+            continue
+        key = (record['query_id'], record['params'], record['query_save_name'])
+        if key not in seen:
+            seen.add(key)
+            task_queries.append(record)
+    logging.info(f"Task queries:\n{tabulate(task_queries, headers='keys')}")
 
-    failed_info_dict = {f"{row['query_id']}{row['query_name']}": [] for row in task_queries.to_dict('records')}
-    async with aiohttp.ClientSession() as session:
+    failed_info_dict = {(row['query_id'], row['query_name']): [] for row in task_queries}
+    connector = aiohttp.TCPConnector(limit=100, limit_per_host=20, keepalive_timeout=75, enable_cleanup_closed=True)
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=60)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout, json_serialize=_orjson_dumps) as session:
         start_run = time.time()
-        tasks = [get_redash_data(row, session, failed_info_dict, start_run) for row in task_queries.to_dict('records')]
+        tasks = [get_redash_data(row, session, failed_info_dict, start_run) for row in task_queries]
         results = await asyncio.gather(*tasks, return_exceptions=True)
     
     final_results = []
@@ -144,42 +223,52 @@ async def execute_redash(task_list):
             last_exception = result.last_attempt.exception()
             if isinstance(last_exception, RedashDataException):
                 row = last_exception.row
-                row['failed_info'] = failed_info_dict.get(f"{row['query_id']}{row['query_name']}", [])
+                row['failed_info'] = failed_info_dict.get((row['query_id'], row['query_name']), [])
                 final_results.append(row)
         elif isinstance(result, RedashDataException):
             row = result.row
-            row['failed_info'] = failed_info_dict.get(f"{row['query_id']}{row['query_name']}", [])
+            row['failed_info'] = failed_info_dict.get((row['query_id'], row['query_name']), [])
             final_results.append(row)
         else:
-            result['failed_info'] = failed_info_dict.get(f"{result['query_id']}{result['query_name']}", [])
+            result['failed_info'] = failed_info_dict.get((result['query_id'], result['query_name']), [])
             final_results.append(result)
 
     failed_details = [info for row in final_results if 'failed_info' in row for info in row['failed_info']]
     if failed_details:
         sorted_failed_details = sorted(failed_details, key=lambda x: (x['query_id'], x['query_name'], x['attempt']))
-        requests.post(CONFIG['webhook_err'], json={'text': "Redash failed data:\n```{}```".format(tabulate(sorted_failed_details, headers='keys'))})
+        failed_fields = ['query_id', 'query_name', 'attempt', 'error']
+        _WEBHOOK.post(CONFIG['webhook_err'], json={'text': "Redash failed data:\n```{}```".format(_format_table(sorted_failed_details, failed_fields))})
 
     fields_to_extract = ['query_id', 'query_name', 'execute_status', 'runtime', 'execute_time', 'rows_cnt', 'query_result_id']
     extracted_data = [{field: row[field] for field in fields_to_extract if field in row} for row in final_results]
-    requests.post(CONFIG['webhook_err'], json={'text': "Redash Results:\n```{}```".format(tabulate(extracted_data, headers='keys'))})
+    _WEBHOOK.post(CONFIG['webhook_err'], json={'text': "Redash Results:\n```{}```".format(_format_table(extracted_data, fields_to_extract))})
 
 # Power BI Functions
+_PBI_TITLE_RE = re.compile(".*" + re.escape(CONFIG['pbi_title']) + ".*") if CONFIG['pbi_title'] else None
+_pbi_cache = {'handle': None, 'window': None}
+
 def get_pbi_window():
-    """Get the Power BI window by title."""
+    """Get the Power BI window by title, reusing the last connected window while it exists."""
+    import ctypes
+    from pywinauto import Application, Desktop
     SW_SHOWMAXIMIZED = 3
     try:
-        windows = Desktop(backend="uia").windows(title_re=".*" + CONFIG['pbi_title'] + ".*")
-        if windows:
+        pbi = _pbi_cache['window']
+        if pbi is None or not pbi.exists():
+            windows = Desktop(backend="uia").windows(title_re=_PBI_TITLE_RE) if _PBI_TITLE_RE else []
+            if not windows:
+                _pbi_cache.update(handle=None, window=None)
+                logging.error(f"No window found with title: {CONFIG['pbi_title']}")
+                return None
             window_id = windows[0].handle
-            ctypes.windll.user32.ShowWindow(window_id, SW_SHOWMAXIMIZED)
             pbi = Application(backend="uia").connect(handle=window_id).window(handle=window_id)
-            pbi.set_focus()
-            time.sleep(3)
-            return pbi
-        else:
-            logging.error(f"No window found with title: {CONFIG['pbi_title']}")
-            return None
+            _pbi_cache.update(handle=window_id, window=pbi)
+        ctypes.windll.user32.ShowWindow(_pbi_cache['handle'], SW_SHOWMAXIMIZED)
+        pbi.set_focus()
+        time.sleep(3)
+        return pbi
     except Exception as e:
+        _pbi_cache.update(handle=None, window=None)
         logging.error(f"Could not find or connect to PBI window: {e}")
         return None
 
@@ -235,6 +324,8 @@ def select_pbi_page(page_name, sleeper):
 
 def export_pbi_file(table_title, sleeper, export_path):
     """Export a table from Power BI to a file."""
+    import pyautogui
+    import pyperclip
     pbi = get_pbi_window()
     if pbi:
         try:
@@ -284,47 +375,61 @@ def export_pbi_file(table_title, sleeper, export_path):
             logging.error(f"Error exporting PBI file: {e}")
 
 # Report Functions
+def _upload_and_notify(task, image_buffer):
+    """Upload a captured report image and post its link to the task webhook."""
+    image_link = upload_image(image_buffer=image_buffer, export_name=task['export_name'], folder_id=task['folder'], service_account_path=CONFIG['service_account_path'])
+    if image_link is None:
+        raise Exception('Upload image failed')
+    if task['send_flag'].lower() == 'y':
+        if task['hyperlink']:
+            _WEBHOOK.post(task['webhook'], json={"text": f"{task['msg_content']}\n{image_link}\nFor detailed data, click <{task['hyperlink']}|*here*>"})
+        else:
+            _WEBHOOK.post(task['webhook'], json={'text': f"{task['msg_content']}\n{image_link}"})
+
 def send_report(task_list):
     """Send reports based on task configurations."""
-    creds = service_account.Credentials.from_service_account_file(CONFIG['service_account_path'], scopes=CONFIG['scopes'])
-    client = gspread.authorize(creds)
-    
+    futures = []
     try:
-        sheet = pd.DataFrame(client.open_by_key(CONFIG['sheet_id']).worksheet("taskMsg").get_all_records())
-        tasks = sheet[(sheet['proceed_flag'].str.lower() == 'y') & (sheet['task_name'].isin(task_list))].reset_index(drop=True)
-
-        for task in tasks.to_dict('records'):
-            select_pbi_page(page_name=task['page'], sleeper=task['page_sleep'])
-            if task['report'] == 'image':
-                image_path = capture_area(left=task['left'], top=task['top'], right=task['right'], bottom=task['bottom'], export_name=task['export_name'])
-                if image_path is None:
-                    raise Exception('Export image failed')
-                image_link = upload_image(file_path=image_path, folder_id=task['folder'], service_account_path=CONFIG['service_account_path'])
-                if image_link is None:
-                    raise Exception('Upload image failed')
-                if task['send_flag'].lower() == 'y':
-                    if task['hyperlink']:
-                        requests.post(task['webhook'], json={"text": f"{task['msg_content']}\n{image_link}\nFor detailed data, click <{task['hyperlink']}|*here*>"})
-                    else:
-                        requests.post(task['webhook'], json={'text': f"{task['msg_content']}\n{image_link}"})
-            
-            elif task['report'] == 'file':
-                export_pbi_file(table_title=task['table_title'], sleeper=task['exp_sleep'], export_path=os.path.join(task['folder'], task['export_name']))
-                if task['send_flag'].lower() == 'y':
-                    requests.post(task['webhook'], json={'text': f"{task['msg_content']}\n{task['hyperlink']}"})
+        task_set = frozenset(task_list)
+        records = _spreadsheet().worksheet("taskMsg").get_all_records()
+        tasks = [record for record in records if str(record['proceed_flag']).lower() == 'y' and record['task_name'] in task_set]
+
+        # A single worker overlaps uploads and posts with GUI work while keeping messages in sheet order
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            for task in tasks:
+                select_pbi_page(page_name=task['page'], sleeper=task['page_sleep'])
+                if task['report'] == 'image':
+                    image_buffer = capture_area(left=task['left'], top=task['top'], right=task['right'], bottom=task['bottom'], export_name=task['export_name'])
+                    if image_buffer is None:
+                        raise Exception('Export image failed')
+                    futures.append((task, pool.submit(_upload_and_notify, task, image_buffer)))
+                
+                elif task['report'] == 'file':
+                    export_pbi_file(table_title=task['table_title'], sleeper=task['exp_sleep'], export_path=os.path.join(task['folder'], task['export_name']))
+                    if task['send_flag'].lower() == 'y':
+                        futures.append((task, pool.submit(_WEBHOOK.post, task['webhook'], json={'text': f"{task['msg_content']}\n{task['hyperlink']}"})))
     
     except Exception as e:
         logging.error(f"Send report error: {str(e)}")
 
+    finally:
+        for task, future in futures:
+            error = future.exception()
+            if error is not None:
+                logging.error(f"Send report error: {task['task_name']} - {task['export_name']}: {str(error)}")
+
 # Scheduler Functions
 def set_schedule():
     """Set up the task schedule from Google Sheets."""
-    creds = service_account.Credentials.from_service_account_file(CONFIG['service_account_path'], scopes=CONFIG['scopes'])
-    client = gspread.authorize(creds)
-    
-    sheet = pd.DataFrame(client.open_by_key(CONFIG['sheet_id']).worksheet("taskSchedule").get_all_records())
-    for time_slot in sheet.columns[4:]:
-        task_list = sheet[sheet[time_slot].str.lower() == 'x']['task_name'].tolist()
+    import schedule
+    records = _spreadsheet().worksheet("taskSchedule").get_all_records()
+    time_slots = list(records[0].keys())[4:] if records else []
+    slot_tasks = {time_slot: [] for time_slot in time_slots}
+    for record in records:
+        for time_slot in time_slots:
+            if str(record.get(time_slot, '')).lower() == 'x':
+                slot_tasks[time_slot].append(record['task_name'])
+    for time_slot, task_list in slot_tasks.items():
         if task_list:
             schedule.every().day.at(time_slot).do(main, get_redash=True, ref_pbi=True, task_list=task_list)
     
@@ -332,27 +437,21 @@ def set_schedule():
         try:
             schedule.run_pending()
         except Exception as e:
-            current_time = time.strftime("%H:%M:%Analyzer
+            current_time = time.strftime("%H:%M:%S")
             logging.error(f"Schedule failed at {current_time}. Error: {e}")
-            time.sleep(1)
+        time.sleep(1)
 
 def run_manual_once():
     """Run tasks marked for one-time execution."""
-    creds = service_account.Credentials.from_service_account_file(CONFIG['service_account_path'], scopes=CONFIG['scopes'])
-    client = gspread.authorize(creds)
-    
-    sheet = pd.DataFrame(client.open_by_key(CONFIG['sheet_id']).worksheet("taskSchedule").get_all_records())
-    task_list = sheet[sheet['once'].str.lower() == 'x']['task_name'].tolist()
+    records = _spreadsheet().worksheet("taskSchedule").get_all_records()
+    task_list = [record['task_name'] for record in records if str(record['once']).lower() == 'x']
     if task_list:
         main(get_redash=True, ref_pbi=True, task_list=task_list)
 
 def run_manual_quick():
     """Run tasks marked for quick execution."""
-    creds = service_account.Credentials.from_service_account_file(CONFIG['service_account_path'], scopes=CONFIG['scopes'])
-    client = gspread.authorize(creds)
-    
-    sheet = pd.DataFrame(client.open_by_key(CONFIG['sheet_id']).worksheet("taskSchedule").get_all_records())
-    task_list = sheet[sheet['quick'].str.lower() == 'x']['task_name'].tolist()
+    records = _spreadsheet().worksheet("taskSchedule").get_all_records()
+    task_list = [record['task_name'] for record in records if str(record['quick']).lower() == 'x']
     if task_list:
         main(ref_pbi=True, task_list=task_list)
 
@@ -371,14 +470,14 @@ def main(get_redash=False, ref_pbi=False, task_list=[]):
         pbi = get_pbi_window()
         if ref_pbi:
             if not refresh_pbi(pbi):
-                requests.post(CONFIG['webhook_err'], json={'text': "PBI refresh failed, cancelled"})
+                _WEBHOOK.post(CONFIG['webhook_err'], json={'text': "PBI refresh failed, cancelled"})
                 raise Exception('PBI refresh failed, cancelled')
 
         logging.info('Sending reports')
         send_report(task_list)
         logging.info('Ended send report')
     except Exception as e:
-        requests.post(CONFIG['webhook_err'], json={'text': f'Function main failed: {str(e)}'})
+        _WEBHOOK.post(CONFIG['webhook_err'], json={'text': f'Function main failed: {str(e)}'})
         logging.error(f'Function main failed: {str(e)}')
         logging.info('Ended send report')
 
@@ -1,6 +1,7 @@
 import os
 import logging
-import tempfile
+import functools
+import io
 from datetime import datetime
 from PIL import ImageGrab
 from pydrive2.auth import GoogleAuth
@@ -24,36 +25,42 @@ def setup_logging(log_path):
     logging.info('Logging system initialized')
 
 def capture_area(left, top, right, bottom, export_name):
-    """Capture a screen area and save as an image."""
+    """Capture a screen area and return it as an in-memory PNG image."""
     try:
         image = ImageGrab.grab(bbox=(left, top, right, bottom))
-        temp_path = tempfile.gettempdir()
-        image_path = os.path.join(temp_path, export_name)
-        image.save(image_path, format='PNG')
-        return image_path
+        image_buffer = io.BytesIO()
+        image.save(image_buffer, format='PNG', compress_level=1)
+        image_buffer.seek(0)
+        return image_buffer
     except Exception as e:
         logging.error(f"Capture image {export_name} failed: {str(e)}")
         return None
 
-def upload_image(file_path, folder_id, service_account_path):
-    """Upload an image to Google Drive and return a shared link."""
-    try:
-        gauth_settings = {
-            'client_config_backend': 'service',
-            'service_config': {
-                'client_json_file_path': service_account_path
-            }
+@functools.lru_cache(maxsize=1)
+def _drive_client(service_account_path):
+    """Authenticate with the service account once and reuse the Drive client."""
+    gauth_settings = {
+        'client_config_backend': 'service',
+        'service_config': {
+            'client_json_file_path': service_account_path
         }
-        gauth = GoogleAuth(settings=gauth_settings)
-        gauth.ServiceAuth()
-        drive = GoogleDrive(gauth)
+    }
+    gauth = GoogleAuth(settings=gauth_settings)
+    gauth.ServiceAuth()
+    return GoogleDrive(gauth)
+
+def upload_image(image_buffer, export_name, folder_id, service_account_path):
+    """Upload an in-memory PNG image to Google Drive and return a shared link."""
+    try:
+        drive = _drive_client(service_account_path)
         
         file_metadata = {
             'title': 'image.jpg',
+            'mimeType': 'image/png',
             'parents': [{'id': folder_id}]
         }
         file_drive = drive.CreateFile(file_metadata)
-        file_drive.SetContentFile(file_path)
+        file_drive.content = image_buffer
         file_drive.Upload()
         
         file_drive.InsertPermission({
@@ -63,11 +70,22 @@ def upload_image(file_path, folder_id, service_account_path):
         })
         return f"https://drive.google.com/file/d/{file_drive['id']}/view"
     except Exception as e:
-        logging.error(f"Upload image {os.path.basename(file_path)} failed: {str(e)}")
+        logging.error(f"Upload image {export_name} failed: {str(e)}")
         return None
 
+_NUMPY_CONVERTERS = {
+    np.int64: int,
+    np.int32: int,
+    np.float64: float,
+    np.float32: float,
+    np.ndarray: np.ndarray.tolist
+}
+
 def convert_numpy(obj):
     """Convert NumPy types to Python native types."""
+    converter = _NUMPY_CONVERTERS.get(type(obj))
+    if converter is not None:
+        return converter(obj)
     if isinstance(obj, np.integer):
         return int(obj)
     elif isinstance(obj, np.floating):